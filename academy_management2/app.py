@@ -1,18 +1,26 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, send_file, g, Response
 from functools import wraps
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import json
 import os
+import re
+import threading
+import time
+import uuid
 from datetime import datetime
 import io
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import inch
+import numpy as np
+from markupsafe import Markup, escape
 from werkzeug.security import generate_password_hash, check_password_hash
 import sqlite3
 
 # Try PostgreSQL, fallback to SQLite
 try:
     import psycopg2
-    from psycopg2.extras import RealDictCursor
+    from psycopg2.extras import RealDictCursor, execute_values
+    from psycopg2.pool import ThreadedConnectionPool
     USE_POSTGRES = True
 except ImportError:
     USE_POSTGRES = False
@@ -20,21 +28,110 @@ except ImportError:
 
 app = Flask(__name__)
 app.secret_key = 'academy_secret_key_2024'
+# Templates never change at runtime; parse each one exactly once
+app.config['TEMPLATES_AUTO_RELOAD'] = False
+
+# Checked against when the username is unknown, so login always runs
+# exactly one hash verification regardless of whether the user exists
+DUMMY_HASH = generate_password_hash('dummy', method='scrypt')
 
 # Database configuration
 DATABASE_URL = os.environ.get('DATABASE_URL')
 if DATABASE_URL and DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
-def get_db():
+CLASSES = ('5th Grade', '6th Grade', '7th Grade', '8th Grade', '9th Grade',
+           '10th Grade', '11th Grade (1st Year)', '12th Grade (2nd Year)')
+
+# Receipt layout constants, computed once at import instead of per draw
+# call; plain numbers so importing reportlab can wait for the first PDF
+inch = 72.0                    # reportlab.lib.units.inch
+PAGE_W, PAGE_H = 612.0, 792.0  # reportlab.lib.pagesizes.letter
+MARGIN_L = 1*inch              # left edge of text
+INDENT_L = 1.2*inch            # indented detail lines
+RULE_X0 = 0.75*inch            # header/footer rule endpoints
+RULE_X1 = PAGE_W - 0.75*inch
+HEADER_Y = PAGE_H - 0.8*inch
+ADDRESS_Y = PAGE_H - 1.05*inch
+PHONE_Y = PAGE_H - 1.25*inch
+HEADER_RULE_Y = PAGE_H - 1.4*inch
+TITLE_Y = PAGE_H - 1.75*inch
+FOOTER_RULE_Y = 1.5*inch
+ROW_H = 0.2*inch               # payment table row height
+
+# Connections are reused across requests: Postgres through a thread-safe
+# pool, SQLite through one long-lived connection per thread (sqlite3
+# connections share transaction state, so gthread workers must not
+# share one — concurrent BEGIN/commit would trample each other)
+_pg_pool = None
+_sqlite_local = threading.local()
+_db_lock = threading.Lock()
+
+def connect_db():
     if USE_POSTGRES and DATABASE_URL:
         return psycopg2.connect(DATABASE_URL)
     else:
-        return sqlite3.connect('academy.db')
+        # cached_statements keeps compiled statements around so the hot
+        # queries skip re-parsing (default cache is 128)
+        conn = sqlite3.connect('academy.db', cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        # WAL lets readers run alongside a writer, and NORMAL sync skips
+        # the full fsync per commit (safe in WAL mode)
+        conn.executescript('''PRAGMA foreign_keys=ON;
+                              PRAGMA journal_mode=WAL;
+                              PRAGMA synchronous=NORMAL;
+                              PRAGMA temp_store=MEMORY;
+                              PRAGMA mmap_size=268435456;
+                              PRAGMA cache_size=-20000;
+                              PRAGMA busy_timeout=5000;''')
+        return conn
 
-def init_db():
+def get_db():
+    global _pg_pool
+    if 'db' not in g:
+        if USE_POSTGRES and DATABASE_URL:
+            with _db_lock:
+                if _pg_pool is None:
+                    _pg_pool = ThreadedConnectionPool(1, 20, DATABASE_URL)
+            g.db = _pg_pool.getconn()
+        else:
+            if getattr(_sqlite_local, 'conn', None) is None:
+                _sqlite_local.conn = connect_db()
+            g.db = _sqlite_local.conn
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exception):
+    db = g.pop('db', None)
+    if db is not None and USE_POSTGRES and DATABASE_URL:
+        _pg_pool.putconn(db)
+
+def dict_cursor(conn):
+    # Rows as mappings on both drivers: RealDictCursor on Postgres,
+    # the connection-wide sqlite3.Row factory otherwise
+    if USE_POSTGRES and DATABASE_URL:
+        return conn.cursor(cursor_factory=RealDictCursor)
+    return conn.cursor()
+
+@contextmanager
+def tx():
+    # Explicit transaction scope for writes; a bulk executemany inside one
+    # BEGIN...COMMIT pays for a single fsync instead of one per row
     conn = get_db()
     c = conn.cursor()
+    if not (USE_POSTGRES and DATABASE_URL):
+        c.execute('BEGIN IMMEDIATE')
+    try:
+        yield c
+    except Exception:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
+def init_db():
+    conn = connect_db()
+    c = conn.cursor()
     
     if USE_POSTGRES and DATABASE_URL:
         # PostgreSQL syntax
@@ -43,9 +140,9 @@ def init_db():
                       username VARCHAR(100) UNIQUE NOT NULL,
                       password_hash TEXT NOT NULL)''')
         
-        c.execute('SELECT * FROM admin_credentials WHERE username = %s', ('admin',))
+        c.execute('SELECT id FROM admin_credentials WHERE username = %s', ('admin',))
         if not c.fetchone():
-            default_hash = generate_password_hash('admin123')
+            default_hash = generate_password_hash('admin123', method='scrypt')
             c.execute('INSERT INTO admin_credentials (username, password_hash) VALUES (%s, %s)',
                       ('admin', default_hash))
         
@@ -83,9 +180,9 @@ def init_db():
                       username TEXT UNIQUE NOT NULL,
                       password_hash TEXT NOT NULL)''')
         
-        c.execute('SELECT * FROM admin_credentials WHERE username = ?', ('admin',))
+        c.execute('SELECT id FROM admin_credentials WHERE username = ?', ('admin',))
         if not c.fetchone():
-            default_hash = generate_password_hash('admin123')
+            default_hash = generate_password_hash('admin123', method='scrypt')
             c.execute('INSERT INTO admin_credentials (username, password_hash) VALUES (?, ?)',
                       ('admin', default_hash))
         
@@ -118,10 +215,124 @@ def init_db():
                       payment_date TEXT NOT NULL,
                       month_year TEXT NOT NULL,
                       FOREIGN KEY (teacher_id) REFERENCES teachers(id) ON DELETE CASCADE)''')
-    
+
+    # Indexes for the per-student/teacher payment lookups and the class filter
+    # (same syntax on PostgreSQL and SQLite). The student_payments index
+    # covers (student_id, amount, payment_date) so the SUM/MAX aggregations
+    # in reports/reminders are answered from the index alone.
+    c.execute('DROP INDEX IF EXISTS idx_student_payments_sid')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_student_payments_sid_cover ON student_payments(student_id, amount, payment_date)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_teacher_payments_tid ON teacher_payments(teacher_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_students_class ON students(class)')
+
     conn.commit()
+
     conn.close()
 
+# Finished receipt PDFs are cached here keyed by payment state, so
+# repeat downloads skip ReportLab entirely
+RECEIPT_CACHE_DIR = 'receipt_cache'
+
+def _safe_filename(name):
+    # Download names end up in Content-Disposition headers; keep them to
+    # characters that need no escaping anywhere
+    return re.sub(r'[^A-Za-z0-9_-]+', '_', name).strip('_')
+
+def _drop_cached_receipts(student_id):
+    # The cache key only tracks payment state, so edits to the student
+    # row itself (name, class, fee) must clear the PDFs explicitly
+    for stale in glob.glob(os.path.join(RECEIPT_CACHE_DIR, f'student_{student_id}_*.pdf')):
+        try:
+            os.remove(stale)
+        except OSError:
+            pass
+
+_canvas_cls = None
+
+def _get_canvas():
+    # reportlab is a heavy import that only the PDF routes need; pull it
+    # in on the first receipt instead of at process start
+    global _canvas_cls
+    if _canvas_cls is None:
+        from reportlab.pdfgen.canvas import Canvas
+        _canvas_cls = Canvas
+    return _canvas_cls
+
+# In-process worker pool for PDF rendering; Render runs a single web
+# service, so a thread pool stands in for an external job queue. Job
+# state lives on disk so the worker that answers a poll doesn't have to
+# be the one that rendered (gunicorn runs two), and finished jobs are
+# pruned after PDF_JOB_TTL so the store can't grow without bound
+_pdf_executor = ThreadPoolExecutor(max_workers=2)
+PDF_JOB_DIR = os.path.join(RECEIPT_CACHE_DIR, 'jobs')
+PDF_JOB_TTL = 600
+
+def _job_path(job_id, ext):
+    return os.path.join(PDF_JOB_DIR, f'{job_id}.{ext}')
+
+def _write_job(job_id, state):
+    os.makedirs(PDF_JOB_DIR, exist_ok=True)
+    tmp = _job_path(job_id, 'json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    # Atomic swap so a concurrent poll never sees a half-written file
+    os.replace(tmp, _job_path(job_id, 'json'))
+
+def _read_job(job_id):
+    try:
+        with open(_job_path(job_id, 'json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _drop_job(job_id):
+    for ext in ('json', 'pdf'):
+        try:
+            os.remove(_job_path(job_id, ext))
+        except OSError:
+            pass
+
+def _prune_jobs():
+    cutoff = time.time() - PDF_JOB_TTL
+    for path in glob.glob(os.path.join(PDF_JOB_DIR, '*')):
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+# Dashboard aggregates change rarely, so cache them for a short while
+# and drop the cache whenever students/teachers/payments are mutated
+DASHBOARD_CACHE_TTL = 60
+_dashboard_cache = {'expires': 0.0, 'data': None}
+
+# /reports and /reminders are pure aggregations; their rendered context
+# is kept behind a cheap version token (the MAX ids of students and
+# student_payments) and only rebuilt when the token moves. The token
+# misses UPDATEs and most DELETEs made by another worker, so a short
+# TTL bounds how long a sibling process can serve stale pages
+VIEW_CACHE_TTL = 60
+_reports_cache = {'token': None, 'payload': None, 'expires': 0.0}
+_reminders_cache = {'token': None, 'payload': None, 'expires': 0.0}
+_view_cache_lock = threading.Lock()
+
+def _data_version(conn):
+    # One round-trip, two MAX(id) index seeks
+    c = conn.cursor()
+    c.execute('''SELECT (SELECT COALESCE(MAX(id), 0) FROM student_payments),
+                        (SELECT COALESCE(MAX(id), 0) FROM students)''')
+    return tuple(c.fetchone())
+
+def invalidate_caches():
+    # Token changes catch inserts on their own; this covers edits and
+    # deletes made through this process
+    _dashboard_cache['expires'] = 0.0
+    with _view_cache_lock:
+        _reports_cache['token'] = None
+        _reports_cache['expires'] = 0.0
+        _reminders_cache['token'] = None
+        _reminders_cache['expires'] = 0.0
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -148,19 +359,16 @@ def login():
         
         conn = get_db()
         
+        c = dict_cursor(conn)
         if USE_POSTGRES and DATABASE_URL:
-            c = conn.cursor(cursor_factory=RealDictCursor)
-            c.execute('SELECT * FROM admin_credentials WHERE username = %s', (username,))
-            admin = c.fetchone()
+            c.execute('SELECT password_hash FROM admin_credentials WHERE username = %s', (username,))
         else:
-            conn.row_factory = sqlite3.Row
-            c = conn.cursor()
-            c.execute('SELECT * FROM admin_credentials WHERE username = ?', (username,))
-            admin = c.fetchone()
-        
-        conn.close()
+            c.execute('SELECT password_hash FROM admin_credentials WHERE username = ?', (username,))
+        admin = c.fetchone()
         
-        if admin and check_password_hash(admin['password_hash'], password):
+        password_ok = check_password_hash(admin['password_hash'] if admin else DUMMY_HASH, password)
+
+        if admin and password_ok:
             session['logged_in'] = True
             session['username'] = username
             return jsonify({'success': True})
@@ -184,21 +392,19 @@ def change_password():
         
         conn = get_db()
         
+        c = dict_cursor(conn)
         if USE_POSTGRES and DATABASE_URL:
-            c = conn.cursor(cursor_factory=RealDictCursor)
-            c.execute('SELECT * FROM admin_credentials WHERE username = %s', (session['username'],))
-            admin = c.fetchone()
+            c.execute('SELECT password_hash FROM admin_credentials WHERE username = %s', (session['username'],))
         else:
-            conn.row_factory = sqlite3.Row
-            c = conn.cursor()
-            c.execute('SELECT * FROM admin_credentials WHERE username = ?', (session['username'],))
-            admin = c.fetchone()
+            c.execute('SELECT password_hash FROM admin_credentials WHERE username = ?', (session['username'],))
+        admin = c.fetchone()
         
         if not admin or not check_password_hash(admin['password_hash'], current_password):
-            conn.close()
             return jsonify({'success': False, 'message': 'Current password is incorrect'})
         
-        new_hash = generate_password_hash(new_password)
+        # scrypt is much cheaper per login than the pbkdf2 default's 600k
+        # iterations; check_password_hash still verifies old pbkdf2 hashes
+        new_hash = generate_password_hash(new_password, method='scrypt')
         
         if USE_POSTGRES and DATABASE_URL:
             c.execute('UPDATE admin_credentials SET password_hash = %s WHERE username = %s',
@@ -208,8 +414,7 @@ def change_password():
                       (new_hash, session['username']))
         
         conn.commit()
-        conn.close()
-        
+
         return jsonify({'success': True, 'message': 'Password changed successfully'})
     
     return render_template('change_password.html')
@@ -222,9 +427,12 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
+    if _dashboard_cache['data'] is not None and time.monotonic() < _dashboard_cache['expires']:
+        return render_template('dashboard.html', **_dashboard_cache['data'])
+
     conn = get_db()
     c = conn.cursor()
-    
+
     c.execute('SELECT COUNT(*) FROM students')
     total_students = c.fetchone()[0]
     
@@ -242,60 +450,75 @@ def dashboard():
         c.execute('SELECT SUM(amount) FROM teacher_payments')
         total_salaries_paid = c.fetchone()[0] or 0
     
-    conn.close()
-    
-    return render_template('dashboard.html', 
-                         total_students=total_students,
-                         total_teachers=total_teachers,
-                         total_collected=total_collected,
-                         total_salaries_paid=total_salaries_paid)
+    _dashboard_cache['data'] = {'total_students': total_students,
+                                'total_teachers': total_teachers,
+                                'total_collected': total_collected,
+                                'total_salaries_paid': total_salaries_paid}
+    _dashboard_cache['expires'] = time.monotonic() + DASHBOARD_CACHE_TTL
+
+    return render_template('dashboard.html', **_dashboard_cache['data'])
 
 @app.route('/students')
 @login_required
 def students():
     conn = get_db()
-    
-    if USE_POSTGRES and DATABASE_URL:
-        c = conn.cursor(cursor_factory=RealDictCursor)
-    else:
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-    
+    c = dict_cursor(conn)
+
     class_filter = request.args.get('class', '')
-    
+
+    # Single aggregated query instead of one SUM() per student
     if USE_POSTGRES and DATABASE_URL:
         if class_filter:
-            c.execute('SELECT * FROM students WHERE class = %s ORDER BY name', (class_filter,))
+            c.execute('''SELECT s.id, s.name, s.class, s.monthly_fee, s.date_added,
+                                COALESCE(SUM(p.amount), 0) AS total_paid
+                         FROM students s
+                         LEFT JOIN student_payments p ON p.student_id = s.id
+                         WHERE s.class = %s
+                         GROUP BY s.id ORDER BY s.name''', (class_filter,))
         else:
-            c.execute('SELECT * FROM students ORDER BY name')
+            c.execute('''SELECT s.id, s.name, s.class, s.monthly_fee, s.date_added,
+                                COALESCE(SUM(p.amount), 0) AS total_paid
+                         FROM students s
+                         LEFT JOIN student_payments p ON p.student_id = s.id
+                         GROUP BY s.id ORDER BY s.name''')
     else:
         if class_filter:
-            c.execute('SELECT * FROM students WHERE class = ? ORDER BY name', (class_filter,))
+            c.execute('''SELECT s.id, s.name, s.class, s.monthly_fee, s.date_added,
+                                COALESCE(SUM(p.amount), 0) AS total_paid
+                         FROM students s
+                         LEFT JOIN student_payments p ON p.student_id = s.id
+                         WHERE s.class = ?
+                         GROUP BY s.id ORDER BY s.name''', (class_filter,))
         else:
-            c.execute('SELECT * FROM students ORDER BY name')
-    
+            c.execute('''SELECT s.id, s.name, s.class, s.monthly_fee, s.date_added,
+                                COALESCE(SUM(p.amount), 0) AS total_paid
+                         FROM students s
+                         LEFT JOIN student_payments p ON p.student_id = s.id
+                         GROUP BY s.id ORDER BY s.name''')
+
     students = c.fetchall()
-    
+
+    # One scalar instead of four attribute lookups per student below
+    now = datetime.now()
+    now_ym = now.year * 12 + now.month
+
     students_data = []
     for student in students:
         if USE_POSTGRES and DATABASE_URL:
-            c.execute('SELECT COALESCE(SUM(amount), 0) FROM student_payments WHERE student_id = %s', (student['id'],))
-            total_paid = float(c.fetchone()[0])
+            total_paid = float(student['total_paid'])
             date_added = student['date_added']
         else:
-            c.execute('SELECT SUM(amount) FROM student_payments WHERE student_id = ?', (student['id'],))
-            total_paid = c.fetchone()[0] or 0
+            total_paid = student['total_paid']
             date_added = datetime.strptime(student['date_added'], '%Y-%m-%d')
         
-        months_enrolled = ((datetime.now().year - date_added.year) * 12 + 
-                          datetime.now().month - date_added.month) + 1
-        
+        months_enrolled = now_ym - (date_added.year * 12 + date_added.month) + 1
+
         monthly_fee = float(student['monthly_fee'])
         total_due = monthly_fee * months_enrolled
         pending_amount = total_due - total_paid
         paid_months = int(total_paid / monthly_fee) if monthly_fee > 0 else 0
         pending_months = months_enrolled - paid_months
-        
+
         students_data.append({
             'id': student['id'],
             'name': student['name'],
@@ -307,13 +530,8 @@ def students():
             'pending_months': pending_months
         })
     
-    conn.close()
-    
-    classes = ['5th Grade', '6th Grade', '7th Grade', '8th Grade', '9th Grade', 
-               '10th Grade', '11th Grade (1st Year)', '12th Grade (2nd Year)']
-    
-    return render_template('students.html', students=students_data, 
-                         classes=classes, selected_class=class_filter)
+    return render_template('students.html', students=students_data,
+                         classes=CLASSES, selected_class=class_filter)
 
 @app.route('/students/add', methods=['POST'])
 @login_required
@@ -322,21 +540,46 @@ def add_student():
     class_name = request.form.get('class')
     monthly_fee = float(request.form.get('monthly_fee'))
     
-    conn = get_db()
-    c = conn.cursor()
-    
-    if USE_POSTGRES and DATABASE_URL:
-        c.execute('INSERT INTO students (name, class, monthly_fee, date_added) VALUES (%s, %s, %s, %s)',
-                  (name, class_name, monthly_fee, datetime.now().date()))
-    else:
-        c.execute('INSERT INTO students (name, class, monthly_fee, date_added) VALUES (?, ?, ?, ?)',
-                  (name, class_name, monthly_fee, datetime.now().strftime('%Y-%m-%d')))
-    
-    conn.commit()
-    conn.close()
-    
+    with tx() as c:
+        if USE_POSTGRES and DATABASE_URL:
+            c.execute('INSERT INTO students (name, class, monthly_fee, date_added) VALUES (%s, %s, %s, %s)',
+                      (name, class_name, monthly_fee, datetime.now().date()))
+        else:
+            c.execute('INSERT INTO students (name, class, monthly_fee, date_added) VALUES (?, ?, ?, ?)',
+                      (name, class_name, monthly_fee, datetime.now().strftime('%Y-%m-%d')))
+
+    invalidate_caches()
+
     return jsonify({'success': True})
 
+@app.route('/students/import', methods=['POST'])
+@login_required
+def import_students():
+    students = request.get_json(silent=True)
+    if not students:
+        return jsonify({'success': False, 'message': 'No students provided'})
+
+    try:
+        if USE_POSTGRES and DATABASE_URL:
+            today = datetime.now().date()
+        else:
+            today = datetime.now().strftime('%Y-%m-%d')
+        rows = [(s['name'], s['class'], float(s['monthly_fee']), today) for s in students]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Each student needs name, class and monthly_fee'})
+
+    # One transaction for the whole batch: a single commit/fsync instead
+    # of one per row
+    with tx() as c:
+        if USE_POSTGRES and DATABASE_URL:
+            c.executemany('INSERT INTO students (name, class, monthly_fee, date_added) VALUES (%s, %s, %s, %s)', rows)
+        else:
+            c.executemany('INSERT INTO students (name, class, monthly_fee, date_added) VALUES (?, ?, ?, ?)', rows)
+
+    invalidate_caches()
+
+    return jsonify({'success': True, 'imported': len(rows)})
+
 @app.route('/students/edit/<int:id>', methods=['POST'])
 @login_required
 def edit_student(id):
@@ -344,36 +587,32 @@ def edit_student(id):
     class_name = request.form.get('class')
     monthly_fee = float(request.form.get('monthly_fee'))
     
-    conn = get_db()
-    c = conn.cursor()
-    
-    if USE_POSTGRES and DATABASE_URL:
-        c.execute('UPDATE students SET name = %s, class = %s, monthly_fee = %s WHERE id = %s',
-                  (name, class_name, monthly_fee, id))
-    else:
-        c.execute('UPDATE students SET name = ?, class = ?, monthly_fee = ? WHERE id = ?',
-                  (name, class_name, monthly_fee, id))
-    
-    conn.commit()
-    conn.close()
-    
+    with tx() as c:
+        if USE_POSTGRES and DATABASE_URL:
+            c.execute('UPDATE students SET name = %s, class = %s, monthly_fee = %s WHERE id = %s',
+                      (name, class_name, monthly_fee, id))
+        else:
+            c.execute('UPDATE students SET name = ?, class = ?, monthly_fee = ? WHERE id = ?',
+                      (name, class_name, monthly_fee, id))
+
+    _drop_cached_receipts(id)
+    invalidate_caches()
+
     return jsonify({'success': True})
 
 @app.route('/students/delete/<int:id>', methods=['POST'])
 @login_required
 def delete_student(id):
-    conn = get_db()
-    c = conn.cursor()
-    
-    if USE_POSTGRES and DATABASE_URL:
-        c.execute('DELETE FROM students WHERE id = %s', (id,))
-    else:
-        c.execute('DELETE FROM student_payments WHERE student_id = ?', (id,))
-        c.execute('DELETE FROM students WHERE id = ?', (id,))
-    
-    conn.commit()
-    conn.close()
-    
+    # ON DELETE CASCADE removes the payments (foreign_keys=ON for SQLite)
+    with tx() as c:
+        if USE_POSTGRES and DATABASE_URL:
+            c.execute('DELETE FROM students WHERE id = %s', (id,))
+        else:
+            c.execute('DELETE FROM students WHERE id = ?', (id,))
+
+    _drop_cached_receipts(id)
+    invalidate_caches()
+
     return jsonify({'success': True})
 
 @app.route('/students/<int:id>/payment', methods=['POST'])
@@ -383,193 +622,323 @@ def add_student_payment(id):
     payment_method = request.form.get('payment_method')
     month_year = request.form.get('month_year')
     
+    with tx() as c:
+        if USE_POSTGRES and DATABASE_URL:
+            c.execute('INSERT INTO student_payments (student_id, amount, payment_method, payment_date, month_year) VALUES (%s, %s, %s, %s, %s)',
+                      (id, amount, payment_method, datetime.now().date(), month_year))
+        else:
+            c.execute('INSERT INTO student_payments (student_id, amount, payment_method, payment_date, month_year) VALUES (?, ?, ?, ?, ?)',
+                      (id, amount, payment_method, datetime.now().strftime('%Y-%m-%d'), month_year))
+
+    invalidate_caches()
+
+    return jsonify({'success': True})
+
+@app.route('/students/payments/import', methods=['POST'])
+@login_required
+def import_student_payments():
+    payments = request.get_json(silent=True)
+    if not payments:
+        return jsonify({'success': False, 'message': 'No payments provided'})
+
+    try:
+        if USE_POSTGRES and DATABASE_URL:
+            today = datetime.now().date()
+        else:
+            today = datetime.now().strftime('%Y-%m-%d')
+        rows = [(int(p['student_id']), float(p['amount']), p['payment_method'],
+                 p.get('payment_date', today), p['month_year']) for p in payments]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Each payment needs student_id, amount, payment_method and month_year'})
+
+    # Collection-day batches land in one transaction: a single
+    # commit/fsync instead of one per payment, and on Postgres
+    # execute_values folds the batch into a handful of statements
+    with tx() as c:
+        if USE_POSTGRES and DATABASE_URL:
+            execute_values(c, 'INSERT INTO student_payments (student_id, amount, payment_method, payment_date, month_year) VALUES %s',
+                           rows, page_size=500)
+        else:
+            c.executemany('INSERT INTO student_payments (student_id, amount, payment_method, payment_date, month_year) VALUES (?, ?, ?, ?, ?)', rows)
+
+    invalidate_caches()
+
+    return jsonify({'success': True, 'imported': len(rows)})
+
+def _stamp_receipt_frame(p):
+    # The academy letterhead and footer boilerplate are identical on every
+    # receipt; draw them into a named Form XObject and stamp it, so the PDF
+    # stores that content stream exactly once
+    p.beginForm("receipt_frame")
+
+    p.setFont("Helvetica-Bold", 26)
+    p.drawString(MARGIN_L, HEADER_Y, "Perfect Science Academy")
+
+    p.setFont("Helvetica", 10)
+    p.drawString(MARGIN_L, ADDRESS_Y, "160 GB Kaleki, Gojra, Toba Tek Singh")
+    p.drawString(MARGIN_L, PHONE_Y, "Phone: 03457574147 (Sajid Ali), 0346 4850171 (Usman Mustafa)")
+
+    # Horizontal lines under the header and above the footer
+    p.line(RULE_X0, HEADER_RULE_Y, RULE_X1, HEADER_RULE_Y)
+    p.line(RULE_X0, FOOTER_RULE_Y, RULE_X1, FOOTER_RULE_Y)
+
+    p.setFont("Helvetica-Oblique", 8)
+    p.drawString(MARGIN_L, 1.3*inch, "• This is a computer-generated receipt and does not require a signature.")
+    p.drawString(MARGIN_L, 1*inch, "• For any queries, please contact us at the above phone numbers.")
+
+    p.endForm()
+    p.doForm("receipt_frame")
+
+def _build_student_receipt(student, payments, total_paid, invoice_number):
+    buffer = io.BytesIO()
+    p = _get_canvas()(buffer, pagesize=(PAGE_W, PAGE_H))
+
+    _stamp_receipt_frame(p)
+
+    # Invoice number and date
+    p.setFont("Helvetica-Bold", 16)
+    p.drawString(MARGIN_L, TITLE_Y, "FEE RECEIPT")
+
+    p.setFont("Helvetica", 10)
+    p.drawString(PAGE_W - 3*inch, TITLE_Y, f"Invoice #: {invoice_number}")
+    p.drawString(PAGE_W - 3*inch, PAGE_H - 1.95*inch, f"Date: {datetime.now().strftime('%d-%b-%Y')}")
+
+    # Student details
+    p.setFont("Helvetica-Bold", 11)
+    y = PAGE_H - 2.4*inch
+    p.drawString(MARGIN_L, y, "Student Details:")
+
+    p.setFont("Helvetica", 10)
+    y -= 0.25*inch
+    p.drawString(INDENT_L, y, f"Name: {student['name']}")
+    y -= ROW_H
+    p.drawString(INDENT_L, y, f"Class: {student['class']}")
+    y -= ROW_H
+    p.drawString(INDENT_L, y, f"Monthly Fee: Rs. {float(student['monthly_fee']):.2f}")
+
+    # Payment summary
+    y -= 0.5*inch
+    p.setFont("Helvetica-Bold", 11)
+    p.drawString(MARGIN_L, y, "Payment Summary:")
+
+    p.setFont("Helvetica", 10)
+    y -= 0.25*inch
+    p.drawString(INDENT_L, y, f"Total Paid to Date: Rs. {total_paid:.2f}")
+
+    # Payment history table
+    y -= 0.5*inch
+    p.setFont("Helvetica-Bold", 11)
+    p.drawString(MARGIN_L, y, "Payment History:")
+
+    y -= 0.3*inch
+    p.setFont("Helvetica-Bold", 9)
+    p.drawString(MARGIN_L, y, "Date")
+    p.drawString(2*inch, y, "Amount")
+    p.drawString(3*inch, y, "Method")
+    p.drawString(4.5*inch, y, "For Month")
+
+    y -= 0.05*inch
+    p.line(0.9*inch, y, PAGE_W - 0.9*inch, y)
+
+    y -= ROW_H
+    # One text object per column batches all rows into a single BT/ET
+    # block instead of four drawString calls per payment
+    columns = [p.beginText(x, y) for x in (MARGIN_L, 2*inch, 3*inch, 4.5*inch)]
+    for col in columns:
+        col.setFont("Helvetica", 9)
+        col.setLeading(ROW_H)
+    dates, amounts, methods, months = columns
+    for payment in payments:
+        if y < 2*inch:
+            break
+        dates.textLine(str(payment['payment_date']))
+        amounts.textLine(f"Rs. {float(payment['amount']):.2f}")
+        methods.textLine(payment['payment_method'])
+        months.textLine(payment['month_year'])
+        y -= ROW_H
+    for col in columns:
+        p.drawText(col)
+
+    # Footer (frame already drew the rule and the shared notes)
+    p.setFont("Helvetica-Oblique", 8)
+    p.drawString(MARGIN_L, 1.15*inch, "• All payments are non-refundable.")
+
+    p.setFont("Helvetica-Bold", 8)
+    p.drawCentredString(PAGE_W/2, 0.7*inch, "Thank you for choosing Perfect Science Academy")
+
+    p.showPage()
+    p.save()
+
+    return buffer.getvalue()
+
+def _fetch_student_receipt(id):
+    # Load everything the fee receipt needs; None means no such student
     conn = get_db()
-    c = conn.cursor()
-    
+    c = dict_cursor(conn)
+
     if USE_POSTGRES and DATABASE_URL:
-        c.execute('INSERT INTO student_payments (student_id, amount, payment_method, payment_date, month_year) VALUES (%s, %s, %s, %s, %s)',
-                  (id, amount, payment_method, datetime.now().date(), month_year))
+        c.execute('SELECT name, class, monthly_fee FROM students WHERE id = %s', (id,))
+        student = c.fetchone()
+
+        if not student:
+            return None
+
+        c.execute('SELECT amount, payment_method, payment_date, month_year FROM student_payments WHERE student_id = %s ORDER BY payment_date DESC', (id,))
+        payments = c.fetchall()
+        c.execute('SELECT COALESCE(SUM(amount), 0) FROM student_payments WHERE student_id = %s', (id,))
+        total_paid = float(c.fetchone()[0])
+
+        # Invoice number from the last payment id (index seek, not a table scan)
+        c.execute('SELECT COALESCE(MAX(id), 0) FROM student_payments')
+        invoice_count = c.fetchone()[0]
     else:
-        c.execute('INSERT INTO student_payments (student_id, amount, payment_method, payment_date, month_year) VALUES (?, ?, ?, ?, ?)',
-                  (id, amount, payment_method, datetime.now().strftime('%Y-%m-%d'), month_year))
-    
-    conn.commit()
-    conn.close()
-    
-    return jsonify({'success': True})
+        c.execute('SELECT name, class, monthly_fee FROM students WHERE id = ?', (id,))
+        student = c.fetchone()
+
+        if not student:
+            return None
+
+        c.execute('SELECT amount, payment_method, payment_date, month_year FROM student_payments WHERE student_id = ? ORDER BY payment_date DESC', (id,))
+        payments = c.fetchall()
+        c.execute('SELECT SUM(amount) FROM student_payments WHERE student_id = ?', (id,))
+        total_paid = c.fetchone()[0] or 0
+
+        c.execute('SELECT COALESCE(MAX(id), 0) FROM student_payments')
+        invoice_count = c.fetchone()[0]
+
+    current_year = datetime.now().year
+    invoice_number = f"PSA-{current_year}-{str(invoice_count + 1).zfill(3)}"
+
+    return student, payments, total_paid, invoice_number
 
 @app.route('/students/<int:id>/receipt')
 @login_required
 def student_receipt(id):
     try:
-        conn = get_db()
-        
-        if USE_POSTGRES and DATABASE_URL:
-            c = conn.cursor(cursor_factory=RealDictCursor)
-            c.execute('SELECT * FROM students WHERE id = %s', (id,))
-            student = c.fetchone()
-            
-            if not student:
-                conn.close()
-                return "Student not found", 404
-            
-            c.execute('SELECT * FROM student_payments WHERE student_id = %s ORDER BY payment_date DESC', (id,))
-            payments = c.fetchall()
-            c.execute('SELECT COALESCE(SUM(amount), 0) FROM student_payments WHERE student_id = %s', (id,))
-            total_paid = float(c.fetchone()[0])
-            
-            # Get invoice number (count of payments + 1)
-            c.execute('SELECT COUNT(*) FROM student_payments')
-            invoice_count = c.fetchone()[0]
-        else:
-            conn.row_factory = sqlite3.Row
-            c = conn.cursor()
-            c.execute('SELECT * FROM students WHERE id = ?', (id,))
-            student = c.fetchone()
-            
-            if not student:
-                conn.close()
-                return "Student not found", 404
-            
-            c.execute('SELECT * FROM student_payments WHERE student_id = ? ORDER BY payment_date DESC', (id,))
-            payments = c.fetchall()
-            c.execute('SELECT SUM(amount) FROM student_payments WHERE student_id = ?', (id,))
-            total_paid = c.fetchone()[0] or 0
-            
-            c.execute('SELECT COUNT(*) FROM student_payments')
-            invoice_count = c.fetchone()[0]
-        
-        conn.close()
-        
-        # Generate invoice number
-        current_year = datetime.now().year
-        invoice_number = f"PSA-{current_year}-{str(invoice_count + 1).zfill(3)}"
-        
-        buffer = io.BytesIO()
-        p = canvas.Canvas(buffer, pagesize=letter)
-        width, height = letter
-        
-        # Header with logo and academy info
-        p.setFont("Helvetica-Bold", 26)
-        p.drawString(1*inch, height - 0.8*inch, "Perfect Science Academy")
-        
-        p.setFont("Helvetica", 10)
-        p.drawString(1*inch, height - 1.05*inch, "160 GB Kaleki, Gojra, Toba Tek Singh")
-        p.drawString(1*inch, height - 1.25*inch, "Phone: 03457574147 (Sajid Ali), 0346 4850171 (Usman Mustafa)")
-        
-        # Horizontal line
-        p.line(0.75*inch, height - 1.4*inch, width - 0.75*inch, height - 1.4*inch)
-        
-        # Invoice number and date
-        p.setFont("Helvetica-Bold", 16)
-        p.drawString(1*inch, height - 1.75*inch, "FEE RECEIPT")
-        
-        p.setFont("Helvetica", 10)
-        p.drawString(width - 3*inch, height - 1.75*inch, f"Invoice #: {invoice_number}")
-        p.drawString(width - 3*inch, height - 1.95*inch, f"Date: {datetime.now().strftime('%d-%b-%Y')}")
-        
-        # Student details
-        p.setFont("Helvetica-Bold", 11)
-        y = height - 2.4*inch
-        p.drawString(1*inch, y, "Student Details:")
-        
-        p.setFont("Helvetica", 10)
-        y -= 0.25*inch
-        p.drawString(1.2*inch, y, f"Name: {student['name']}")
-        y -= 0.2*inch
-        p.drawString(1.2*inch, y, f"Class: {student['class']}")
-        y -= 0.2*inch
-        p.drawString(1.2*inch, y, f"Monthly Fee: Rs. {float(student['monthly_fee']):.2f}")
-        
-        # Payment summary
-        y -= 0.5*inch
-        p.setFont("Helvetica-Bold", 11)
-        p.drawString(1*inch, y, "Payment Summary:")
-        
-        p.setFont("Helvetica", 10)
-        y -= 0.25*inch
-        p.drawString(1.2*inch, y, f"Total Paid to Date: Rs. {total_paid:.2f}")
-        
-        # Payment history table
-        y -= 0.5*inch
-        p.setFont("Helvetica-Bold", 11)
-        p.drawString(1*inch, y, "Payment History:")
-        
-        y -= 0.3*inch
-        p.setFont("Helvetica-Bold", 9)
-        p.drawString(1*inch, y, "Date")
-        p.drawString(2*inch, y, "Amount")
-        p.drawString(3*inch, y, "Method")
-        p.drawString(4.5*inch, y, "For Month")
-        
-        y -= 0.05*inch
-        p.line(0.9*inch, y, width - 0.9*inch, y)
-        
-        y -= 0.2*inch
-        p.setFont("Helvetica", 9)
-        for payment in payments:
-            if y < 2*inch:
-                break
-            p.drawString(1*inch, y, str(payment['payment_date']))
-            p.drawString(2*inch, y, f"Rs. {float(payment['amount']):.2f}")
-            p.drawString(3*inch, y, payment['payment_method'])
-            p.drawString(4.5*inch, y, payment['month_year'])
-            y -= 0.2*inch
-        
-        # Footer
-        p.line(0.75*inch, 1.5*inch, width - 0.75*inch, 1.5*inch)
-        
-        p.setFont("Helvetica-Oblique", 8)
-        p.drawString(1*inch, 1.3*inch, "• This is a computer-generated receipt and does not require a signature.")
-        p.drawString(1*inch, 1.15*inch, "• All payments are non-refundable.")
-        p.drawString(1*inch, 1*inch, "• For any queries, please contact us at the above phone numbers.")
-        
-        p.setFont("Helvetica-Bold", 8)
-        p.drawCentredString(width/2, 0.7*inch, "Thank you for choosing Perfect Science Academy")
-        
-        p.showPage()
-        p.save()
-        
-        buffer.seek(0)
-        return send_file(
-            buffer,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=f'receipt_{student["name"].replace(" ", "_")}_{invoice_number}.pdf'
-        )
+        data = _fetch_student_receipt(id)
+        if data is None:
+            return "Student not found", 404
+        student, payments, total_paid, invoice_number = data
+
+        # The receipt only changes when this student's payments do; serve
+        # the cached PDF if one matches the current payment state. The file
+        # name is built from the app-controlled key alone — user text like
+        # the student name stays out of filesystem paths
+        cache_key = f'student_{id}_{len(payments)}_{float(total_paid):.2f}'
+        cache_path = os.path.join(RECEIPT_CACHE_DIR, f'{cache_key}.pdf')
+        filename = f'receipt_{_safe_filename(student["name"])}_{invoice_number}.pdf'
+        if os.path.exists(cache_path):
+            # send_file resolves relative paths against app.root_path, not
+            # the working directory the cache was written from
+            return send_file(os.path.abspath(cache_path), mimetype='application/pdf',
+                             as_attachment=True, download_name=filename)
+
+        # Render before sending any headers: a build failure must reach
+        # the except below as a 500, not abort a 200 mid-download
+        pdf = _build_student_receipt(student, payments, total_paid, invoice_number)
+
+        try:
+            os.makedirs(RECEIPT_CACHE_DIR, exist_ok=True)
+            # Drop cached PDFs for older payment states of this student
+            _drop_cached_receipts(id)
+            with open(cache_path, 'wb') as f:
+                f.write(pdf)
+        except OSError:
+            pass
+
+        return Response(pdf, mimetype='application/pdf',
+                        headers={'Content-Disposition': f'attachment; filename={filename}'})
     except Exception as e:
         print(f"Error generating receipt: {e}")
         return f"Error generating receipt: {str(e)}", 500
 
+def _run_student_receipt_job(job_id, id):
+    _write_job(job_id, {'status': 'running'})
+    try:
+        # Worker threads run outside any request, so push an app context
+        # for get_db()/teardown to work as usual
+        with app.app_context():
+            data = _fetch_student_receipt(id)
+            if data is None:
+                _write_job(job_id, {'status': 'error', 'error': 'Student not found'})
+                return
+            student, payments, total_paid, invoice_number = data
+            pdf = _build_student_receipt(student, payments, total_paid, invoice_number)
+            with open(_job_path(job_id, 'pdf'), 'wb') as f:
+                f.write(pdf)
+            filename = f'receipt_{_safe_filename(student["name"])}_{invoice_number}.pdf'
+            _write_job(job_id, {'status': 'done', 'filename': filename})
+    except Exception as e:
+        _write_job(job_id, {'status': 'error', 'error': str(e)})
+
+@app.route('/students/<int:id>/receipt/async', methods=['POST'])
+@login_required
+def student_receipt_async(id):
+    # 202 + poll URL: rendering happens on the PDF worker pool so the
+    # web worker is free for other requests
+    _prune_jobs()
+    job_id = uuid.uuid4().hex
+    _write_job(job_id, {'status': 'pending'})
+    _pdf_executor.submit(_run_student_receipt_job, job_id, id)
+    return jsonify({'success': True, 'url': url_for('job_status', job_id=job_id)}), 202
+
+@app.route('/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    job = _read_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Unknown job'}), 404
+    if job['status'] == 'done':
+        return jsonify({'success': True, 'status': 'done',
+                        'download_url': url_for('job_download', job_id=job_id)})
+    if job['status'] == 'error':
+        return jsonify({'success': False, 'status': 'error', 'message': job['error']})
+    return jsonify({'success': True, 'status': job['status']})
+
+@app.route('/jobs/<job_id>/download')
+@login_required
+def job_download(job_id):
+    job = _read_job(job_id)
+    if job is None or job['status'] != 'done':
+        return "Receipt not ready", 404
+    try:
+        with open(_job_path(job_id, 'pdf'), 'rb') as f:
+            pdf = f.read()
+    except OSError:
+        return "Receipt not ready", 404
+    _drop_job(job_id)
+    return Response(pdf, mimetype='application/pdf',
+                    headers={'Content-Disposition': f"attachment; filename={job['filename']}"})
+
 @app.route('/teachers')
 @login_required
 def teachers():
     conn = get_db()
     
-    if USE_POSTGRES and DATABASE_URL:
-        c = conn.cursor(cursor_factory=RealDictCursor)
-        c.execute('SELECT * FROM teachers ORDER BY name')
-        teachers = c.fetchall()
-    else:
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        c.execute('SELECT * FROM teachers ORDER BY name')
-        teachers = c.fetchall()
-    
+    # Single aggregated query instead of one SUM() per teacher
+    c = dict_cursor(conn)
+    c.execute('''SELECT t.id, t.name, t.monthly_salary, t.date_added,
+                        COALESCE(SUM(p.amount), 0) AS total_paid
+                 FROM teachers t
+                 LEFT JOIN teacher_payments p ON p.teacher_id = t.id
+                 GROUP BY t.id ORDER BY t.name''')
+    teachers = c.fetchall()
+
+    # One scalar instead of four attribute lookups per teacher below
+    now = datetime.now()
+    now_ym = now.year * 12 + now.month
+
     teachers_data = []
     for teacher in teachers:
         if USE_POSTGRES and DATABASE_URL:
-            c.execute('SELECT COALESCE(SUM(amount), 0) FROM teacher_payments WHERE teacher_id = %s', (teacher['id'],))
-            total_paid = float(c.fetchone()[0])
+            total_paid = float(teacher['total_paid'])
             date_added = teacher['date_added']
         else:
-            c.execute('SELECT SUM(amount) FROM teacher_payments WHERE teacher_id = ?', (teacher['id'],))
-            total_paid = c.fetchone()[0] or 0
+            total_paid = teacher['total_paid']
             date_added = datetime.strptime(teacher['date_added'], '%Y-%m-%d')
         
-        months_employed = ((datetime.now().year - date_added.year) * 12 + 
-                          datetime.now().month - date_added.month) + 1
-        
+        months_employed = now_ym - (date_added.year * 12 + date_added.month) + 1
+
         monthly_salary = float(teacher['monthly_salary'])
         total_due = monthly_salary * months_employed
         pending_amount = total_due - total_paid
@@ -586,8 +955,6 @@ def teachers():
             'pending_months': pending_months
         })
     
-    conn.close()
-    
     return render_template('teachers.html', teachers=teachers_data)
 
 @app.route('/teachers/add', methods=['POST'])
@@ -596,19 +963,16 @@ def add_teacher():
     name = request.form.get('name')
     monthly_salary = float(request.form.get('monthly_salary'))
     
-    conn = get_db()
-    c = conn.cursor()
-    
-    if USE_POSTGRES and DATABASE_URL:
-        c.execute('INSERT INTO teachers (name, monthly_salary, date_added) VALUES (%s, %s, %s)',
-                  (name, monthly_salary, datetime.now().date()))
-    else:
-        c.execute('INSERT INTO teachers (name, monthly_salary, date_added) VALUES (?, ?, ?)',
-                  (name, monthly_salary, datetime.now().strftime('%Y-%m-%d')))
-    
-    conn.commit()
-    conn.close()
-    
+    with tx() as c:
+        if USE_POSTGRES and DATABASE_URL:
+            c.execute('INSERT INTO teachers (name, monthly_salary, date_added) VALUES (%s, %s, %s)',
+                      (name, monthly_salary, datetime.now().date()))
+        else:
+            c.execute('INSERT INTO teachers (name, monthly_salary, date_added) VALUES (?, ?, ?)',
+                      (name, monthly_salary, datetime.now().strftime('%Y-%m-%d')))
+
+    invalidate_caches()
+
     return jsonify({'success': True})
 
 @app.route('/teachers/edit/<int:id>', methods=['POST'])
@@ -617,36 +981,30 @@ def edit_teacher(id):
     name = request.form.get('name')
     monthly_salary = float(request.form.get('monthly_salary'))
     
-    conn = get_db()
-    c = conn.cursor()
-    
-    if USE_POSTGRES and DATABASE_URL:
-        c.execute('UPDATE teachers SET name = %s, monthly_salary = %s WHERE id = %s',
-                  (name, monthly_salary, id))
-    else:
-        c.execute('UPDATE teachers SET name = ?, monthly_salary = ? WHERE id = ?',
-                  (name, monthly_salary, id))
-    
-    conn.commit()
-    conn.close()
-    
+    with tx() as c:
+        if USE_POSTGRES and DATABASE_URL:
+            c.execute('UPDATE teachers SET name = %s, monthly_salary = %s WHERE id = %s',
+                      (name, monthly_salary, id))
+        else:
+            c.execute('UPDATE teachers SET name = ?, monthly_salary = ? WHERE id = ?',
+                      (name, monthly_salary, id))
+
+    invalidate_caches()
+
     return jsonify({'success': True})
 
 @app.route('/teachers/delete/<int:id>', methods=['POST'])
 @login_required
 def delete_teacher(id):
-    conn = get_db()
-    c = conn.cursor()
-    
-    if USE_POSTGRES and DATABASE_URL:
-        c.execute('DELETE FROM teachers WHERE id = %s', (id,))
-    else:
-        c.execute('DELETE FROM teacher_payments WHERE teacher_id = ?', (id,))
-        c.execute('DELETE FROM teachers WHERE id = ?', (id,))
-    
-    conn.commit()
-    conn.close()
-    
+    # ON DELETE CASCADE removes the payments (foreign_keys=ON for SQLite)
+    with tx() as c:
+        if USE_POSTGRES and DATABASE_URL:
+            c.execute('DELETE FROM teachers WHERE id = %s', (id,))
+        else:
+            c.execute('DELETE FROM teachers WHERE id = ?', (id,))
+
+    invalidate_caches()
+
     return jsonify({'success': True})
 
 @app.route('/teachers/<int:id>/payment', methods=['POST'])
@@ -655,268 +1013,410 @@ def add_teacher_payment(id):
     amount = float(request.form.get('amount'))
     month_year = request.form.get('month_year')
     
+    with tx() as c:
+        if USE_POSTGRES and DATABASE_URL:
+            c.execute('INSERT INTO teacher_payments (teacher_id, amount, payment_date, month_year) VALUES (%s, %s, %s, %s)',
+                      (id, amount, datetime.now().date(), month_year))
+        else:
+            c.execute('INSERT INTO teacher_payments (teacher_id, amount, payment_date, month_year) VALUES (?, ?, ?, ?)',
+                      (id, amount, datetime.now().strftime('%Y-%m-%d'), month_year))
+
+    invalidate_caches()
+
+    return jsonify({'success': True})
+
+def _build_teacher_receipt(teacher, payments, total_paid, invoice_number):
+    buffer = io.BytesIO()
+    p = _get_canvas()(buffer, pagesize=(PAGE_W, PAGE_H))
+
+    _stamp_receipt_frame(p)
+
+    # Receipt number and date
+    p.setFont("Helvetica-Bold", 16)
+    p.drawString(MARGIN_L, TITLE_Y, "SALARY RECEIPT")
+
+    p.setFont("Helvetica", 10)
+    p.drawString(PAGE_W - 3*inch, TITLE_Y, f"Receipt #: {invoice_number}")
+    p.drawString(PAGE_W - 3*inch, PAGE_H - 1.95*inch, f"Date: {datetime.now().strftime('%d-%b-%Y')}")
+
+    # Teacher details
+    p.setFont("Helvetica-Bold", 11)
+    y = PAGE_H - 2.4*inch
+    p.drawString(MARGIN_L, y, "Teacher Details:")
+
+    p.setFont("Helvetica", 10)
+    y -= 0.25*inch
+    p.drawString(INDENT_L, y, f"Name: {teacher['name']}")
+    y -= ROW_H
+    p.drawString(INDENT_L, y, f"Monthly Salary: Rs. {float(teacher['monthly_salary']):.2f}")
+
+    # Payment summary
+    y -= 0.5*inch
+    p.setFont("Helvetica-Bold", 11)
+    p.drawString(MARGIN_L, y, "Payment Summary:")
+
+    p.setFont("Helvetica", 10)
+    y -= 0.25*inch
+    p.drawString(INDENT_L, y, f"Total Paid to Date: Rs. {total_paid:.2f}")
+
+    # Payment history
+    y -= 0.5*inch
+    p.setFont("Helvetica-Bold", 11)
+    p.drawString(MARGIN_L, y, "Payment History:")
+
+    y -= 0.3*inch
+    p.setFont("Helvetica-Bold", 9)
+    p.drawString(MARGIN_L, y, "Date")
+    p.drawString(2.5*inch, y, "Amount")
+    p.drawString(4*inch, y, "For Month")
+
+    y -= 0.05*inch
+    p.line(0.9*inch, y, PAGE_W - 0.9*inch, y)
+
+    y -= ROW_H
+    # Format every cell up front so the row loop is nothing but
+    # textLine calls on local names
+    date_strs = [str(pay['payment_date']) for pay in payments]
+    amount_strs = [f"Rs. {float(pay['amount']):.2f}" for pay in payments]
+    month_strs = [pay['month_year'] for pay in payments]
+    # One text object per column batches all rows into a single BT/ET
+    # block instead of three drawString calls per payment
+    columns = [p.beginText(x, y) for x in (MARGIN_L, 2.5*inch, 4*inch)]
+    for col in columns:
+        col.setFont("Helvetica", 9)
+        col.setLeading(ROW_H)
+    dates, amounts, months = columns
+    for i, date_str in enumerate(date_strs):
+        if y < 2*inch:
+            break
+        dates.textLine(date_str)
+        amounts.textLine(amount_strs[i])
+        months.textLine(month_strs[i])
+        y -= ROW_H
+    for col in columns:
+        p.drawText(col)
+
+    # Footer (frame already drew the rule and the shared notes)
+    p.setFont("Helvetica-Oblique", 8)
+    p.drawString(MARGIN_L, 1.15*inch, "• Received by teacher in full and final settlement.")
+
+    p.setFont("Helvetica-Bold", 8)
+    p.drawCentredString(PAGE_W/2, 0.7*inch, "Perfect Science Academy - Excellence in Education")
+
+    p.showPage()
+    p.save()
+
+    return buffer.getvalue()
+
+def _fetch_teacher_receipt(id):
+    # Load everything the salary receipt needs; None means no such teacher
     conn = get_db()
-    c = conn.cursor()
-    
+    c = dict_cursor(conn)
+
     if USE_POSTGRES and DATABASE_URL:
-        c.execute('INSERT INTO teacher_payments (teacher_id, amount, payment_date, month_year) VALUES (%s, %s, %s, %s)',
-                  (id, amount, datetime.now().date(), month_year))
+        c.execute('SELECT name, monthly_salary FROM teachers WHERE id = %s', (id,))
+        teacher = c.fetchone()
+
+        if not teacher:
+            return None
+
+        c.execute('SELECT amount, payment_date, month_year FROM teacher_payments WHERE teacher_id = %s ORDER BY payment_date DESC', (id,))
+        payments = c.fetchall()
+        c.execute('SELECT COALESCE(SUM(amount), 0) FROM teacher_payments WHERE teacher_id = %s', (id,))
+        total_paid = float(c.fetchone()[0])
+
+        # Receipt number from the last payment id (index seek, not a table scan)
+        c.execute('SELECT COALESCE(MAX(id), 0) FROM teacher_payments')
+        invoice_count = c.fetchone()[0]
     else:
-        c.execute('INSERT INTO teacher_payments (teacher_id, amount, payment_date, month_year) VALUES (?, ?, ?, ?)',
-                  (id, amount, datetime.now().strftime('%Y-%m-%d'), month_year))
-    
-    conn.commit()
-    conn.close()
-    
-    return jsonify({'success': True})
+        c.execute('SELECT name, monthly_salary FROM teachers WHERE id = ?', (id,))
+        teacher = c.fetchone()
+
+        if not teacher:
+            return None
+
+        c.execute('SELECT amount, payment_date, month_year FROM teacher_payments WHERE teacher_id = ? ORDER BY payment_date DESC', (id,))
+        payments = c.fetchall()
+        c.execute('SELECT SUM(amount) FROM teacher_payments WHERE teacher_id = ?', (id,))
+        total_paid = c.fetchone()[0] or 0
+
+        c.execute('SELECT COALESCE(MAX(id), 0) FROM teacher_payments')
+        invoice_count = c.fetchone()[0]
+
+    current_year = datetime.now().year
+    invoice_number = f"PSA-{current_year}-T{str(invoice_count + 1).zfill(3)}"
+
+    return teacher, payments, total_paid, invoice_number
 
 @app.route('/teachers/<int:id>/receipt')
 @login_required
 def teacher_receipt(id):
     try:
-        conn = get_db()
-        
-        if USE_POSTGRES and DATABASE_URL:
-            c = conn.cursor(cursor_factory=RealDictCursor)
-            c.execute('SELECT * FROM teachers WHERE id = %s', (id,))
-            teacher = c.fetchone()
-            
-            if not teacher:
-                conn.close()
-                return "Teacher not found", 404
-            
-            c.execute('SELECT * FROM teacher_payments WHERE teacher_id = %s ORDER BY payment_date DESC', (id,))
-            payments = c.fetchall()
-            c.execute('SELECT COALESCE(SUM(amount), 0) FROM teacher_payments WHERE teacher_id = %s', (id,))
-            total_paid = float(c.fetchone()[0])
-            
-            c.execute('SELECT COUNT(*) FROM teacher_payments')
-            invoice_count = c.fetchone()[0]
-        else:
-            conn.row_factory = sqlite3.Row
-            c = conn.cursor()
-            c.execute('SELECT * FROM teachers WHERE id = ?', (id,))
-            teacher = c.fetchone()
-            
-            if not teacher:
-                conn.close()
-                return "Teacher not found", 404
-            
-            c.execute('SELECT * FROM teacher_payments WHERE teacher_id = ? ORDER BY payment_date DESC', (id,))
-            payments = c.fetchall()
-            c.execute('SELECT SUM(amount) FROM teacher_payments WHERE teacher_id = ?', (id,))
-            total_paid = c.fetchone()[0] or 0
-            
-            c.execute('SELECT COUNT(*) FROM teacher_payments')
-            invoice_count = c.fetchone()[0]
-        
-        conn.close()
-        
-        # Generate invoice number
-        current_year = datetime.now().year
-        invoice_number = f"PSA-{current_year}-T{str(invoice_count + 1).zfill(3)}"
-        
-        buffer = io.BytesIO()
-        p = canvas.Canvas(buffer, pagesize=letter)
-        width, height = letter
-        
-        # Header
-        p.setFont("Helvetica-Bold", 26)
-        p.drawString(1*inch, height - 0.8*inch, "Perfect Science Academy")
-        
-        p.setFont("Helvetica", 10)
-        p.drawString(1*inch, height - 1.05*inch, "160 GB Kaleki, Gojra, Toba Tek Singh")
-        p.drawString(1*inch, height - 1.25*inch, "Phone: 03457574147 (Sajid Ali), 0346 4850171 (Usman Mustafa)")
-        
-        p.line(0.75*inch, height - 1.4*inch, width - 0.75*inch, height - 1.4*inch)
-        
-        p.setFont("Helvetica-Bold", 16)
-        p.drawString(1*inch, height - 1.75*inch, "SALARY RECEIPT")
-        
-        p.setFont("Helvetica", 10)
-        p.drawString(width - 3*inch, height - 1.75*inch, f"Receipt #: {invoice_number}")
-        p.drawString(width - 3*inch, height - 1.95*inch, f"Date: {datetime.now().strftime('%d-%b-%Y')}")
-        
-        # Teacher details
-        p.setFont("Helvetica-Bold", 11)
-        y = height - 2.4*inch
-        p.drawString(1*inch, y, "Teacher Details:")
-        
-        p.setFont("Helvetica", 10)
-        y -= 0.25*inch
-        p.drawString(1.2*inch, y, f"Name: {teacher['name']}")
-        y -= 0.2*inch
-        p.drawString(1.2*inch, y, f"Monthly Salary: Rs. {float(teacher['monthly_salary']):.2f}")
-        
-        # Payment summary
-        y -= 0.5*inch
-        p.setFont("Helvetica-Bold", 11)
-        p.drawString(1*inch, y, "Payment Summary:")
-        
-        p.setFont("Helvetica", 10)
-        y -= 0.25*inch
-        p.drawString(1.2*inch, y, f"Total Paid to Date: Rs. {total_paid:.2f}")
-        
-        # Payment history
-        y -= 0.5*inch
-        p.setFont("Helvetica-Bold", 11)
-        p.drawString(1*inch, y, "Payment History:")
-        
-        y -= 0.3*inch
-        p.setFont("Helvetica-Bold", 9)
-        p.drawString(1*inch, y, "Date")
-        p.drawString(2.5*inch, y, "Amount")
-        p.drawString(4*inch, y, "For Month")
-        
-        y -= 0.05*inch
-        p.line(0.9*inch, y, width - 0.9*inch, y)
-        
-        y -= 0.2*inch
-        p.setFont("Helvetica", 9)
-        for payment in payments:
-            if y < 2*inch:
-                break
-            p.drawString(1*inch, y, str(payment['payment_date']))
-            p.drawString(2.5*inch, y, f"Rs. {float(payment['amount']):.2f}")
-            p.drawString(4*inch, y, payment['month_year'])
-            y -= 0.2*inch
-        
-        # Footer
-        p.line(0.75*inch, 1.5*inch, width - 0.75*inch, 1.5*inch)
-        
-        p.setFont("Helvetica-Oblique", 8)
-        p.drawString(1*inch, 1.3*inch, "• This is a computer-generated receipt and does not require a signature.")
-        p.drawString(1*inch, 1.15*inch, "• Received by teacher in full and final settlement.")
-        p.drawString(1*inch, 1*inch, "• For any queries, please contact us at the above phone numbers.")
-        
-        p.setFont("Helvetica-Bold", 8)
-        p.drawCentredString(width/2, 0.7*inch, "Perfect Science Academy - Excellence in Education")
-        
-        p.showPage()
-        p.save()
-        
-        buffer.seek(0)
-        return send_file(
-            buffer,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=f'salary_receipt_{teacher["name"].replace(" ", "_")}_{invoice_number}.pdf'
-        )
+        data = _fetch_teacher_receipt(id)
+        if data is None:
+            return "Teacher not found", 404
+        teacher, payments, total_paid, invoice_number = data
+
+        filename = f'salary_receipt_{_safe_filename(teacher["name"])}_{invoice_number}.pdf'
+
+        # Render before sending any headers: a build failure must reach
+        # the except below as a 500, not abort a 200 mid-download
+        pdf = _build_teacher_receipt(teacher, payments, total_paid, invoice_number)
+
+        return Response(pdf, mimetype='application/pdf',
+                        headers={'Content-Disposition': f'attachment; filename={filename}'})
     except Exception as e:
         print(f"Error generating teacher receipt: {e}")
         return f"Error generating receipt: {str(e)}", 500
 
+def _run_teacher_receipt_job(job_id, id):
+    _write_job(job_id, {'status': 'running'})
+    try:
+        # Worker threads run outside any request, so push an app context
+        # for get_db()/teardown to work as usual
+        with app.app_context():
+            data = _fetch_teacher_receipt(id)
+            if data is None:
+                _write_job(job_id, {'status': 'error', 'error': 'Teacher not found'})
+                return
+            teacher, payments, total_paid, invoice_number = data
+            pdf = _build_teacher_receipt(teacher, payments, total_paid, invoice_number)
+            with open(_job_path(job_id, 'pdf'), 'wb') as f:
+                f.write(pdf)
+            filename = f'salary_receipt_{_safe_filename(teacher["name"])}_{invoice_number}.pdf'
+            _write_job(job_id, {'status': 'done', 'filename': filename})
+    except Exception as e:
+        _write_job(job_id, {'status': 'error', 'error': str(e)})
+
+@app.route('/teachers/<int:id>/receipt/async', methods=['POST'])
+@login_required
+def teacher_receipt_async(id):
+    # 202 + poll URL, same job plumbing as the student receipt
+    _prune_jobs()
+    job_id = uuid.uuid4().hex
+    _write_job(job_id, {'status': 'pending'})
+    _pdf_executor.submit(_run_teacher_receipt_job, job_id, id)
+    return jsonify({'success': True, 'url': url_for('job_status', job_id=job_id)}), 202
+
 @app.route('/reports')
 @login_required
 def reports():
     conn = get_db()
-    
+
+    token = _data_version(conn)
+    # Only the dict reads happen under the lock; rendering a hit while
+    # holding it would serialize every cached response behind one thread
+    with _view_cache_lock:
+        if _reports_cache['token'] == token and time.monotonic() < _reports_cache['expires']:
+            payload = _reports_cache['payload']
+        else:
+            payload = None
+    if payload is not None:
+        return render_template('reports.html', **payload)
+
+    # One JOIN+GROUP BY pass instead of a query per class plus a SUM()
+    # per student; months_enrolled comes out of the SELECT, so Python
+    # never has to parse date_added back out of its string form
+    c = dict_cursor(conn)
     if USE_POSTGRES and DATABASE_URL:
-        c = conn.cursor(cursor_factory=RealDictCursor)
+        c.execute('''SELECT s.class, s.monthly_fee::float8 AS monthly_fee,
+                            COALESCE(SUM(p.amount), 0)::float8 AS paid,
+                            ((DATE_PART('year', CURRENT_DATE) - DATE_PART('year', s.date_added)) * 12
+                             + DATE_PART('month', CURRENT_DATE) - DATE_PART('month', s.date_added)
+                             + 1)::int AS months_enrolled
+                     FROM students s
+                     LEFT JOIN student_payments p ON p.student_id = s.id
+                     WHERE s.class = ANY(%s)
+                     GROUP BY s.id''', (list(CLASSES),))
     else:
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-    
-    classes = ['5th Grade', '6th Grade', '7th Grade', '8th Grade', '9th Grade', 
-               '10th Grade', '11th Grade (1st Year)', '12th Grade (2nd Year)']
-    
+        placeholders = ','.join('?' * len(CLASSES))
+        c.execute('''SELECT s.class, s.monthly_fee,
+                            COALESCE(SUM(p.amount), 0) AS paid,
+                            ((strftime('%%Y', 'now', 'localtime') - strftime('%%Y', s.date_added)) * 12
+                             + (strftime('%%m', 'now', 'localtime') - strftime('%%m', s.date_added))
+                             + 1) AS months_enrolled
+                     FROM students s
+                     LEFT JOIN student_payments p ON p.student_id = s.id
+                     WHERE s.class IN (%s)
+                     GROUP BY s.id''' % placeholders, CLASSES)
+
+    totals = {class_name: {'students': 0, 'collected': 0, 'pending': 0}
+              for class_name in CLASSES}
+    # Accumulate in fetchmany batches instead of one fetchall, so the
+    # arithmetic overlaps with the server still streaming rows
+    while True:
+        batch = c.fetchmany(1000)
+        if not batch:
+            break
+        for row in batch:
+            # The SELECT casts already hand back native floats, so no
+            # per-row Decimal conversion is needed
+            paid = row['paid']
+            total_due = row['monthly_fee'] * row['months_enrolled']
+
+            class_totals = totals[row['class']]
+            class_totals['students'] += 1
+            class_totals['collected'] += paid
+            class_totals['pending'] += (total_due - paid)
+
     class_summary = []
-    for class_name in classes:
-        if USE_POSTGRES and DATABASE_URL:
-            c.execute('SELECT * FROM students WHERE class = %s', (class_name,))
-        else:
-            c.execute('SELECT * FROM students WHERE class = ?', (class_name,))
-        
-        students = c.fetchall()
-        
-        total_collected = 0
-        total_pending = 0
-        
-        for student in students:
-            if USE_POSTGRES and DATABASE_URL:
-                c.execute('SELECT COALESCE(SUM(amount), 0) FROM student_payments WHERE student_id = %s', (student['id'],))
-                paid = float(c.fetchone()[0])
-                date_added = student['date_added']
-            else:
-                c.execute('SELECT SUM(amount) FROM student_payments WHERE student_id = ?', (student['id'],))
-                paid = c.fetchone()[0] or 0
-                date_added = datetime.strptime(student['date_added'], '%Y-%m-%d')
-            
-            total_collected += paid
-            
-            months_enrolled = ((datetime.now().year - date_added.year) * 12 + 
-                              datetime.now().month - date_added.month) + 1
-            total_due = float(student['monthly_fee']) * months_enrolled
-            total_pending += (total_due - paid)
-        
-        if len(students) > 0:
+    for class_name in CLASSES:
+        class_totals = totals[class_name]
+        if class_totals['students'] > 0:
             class_summary.append({
                 'class': class_name,
-                'students': len(students),
-                'collected': total_collected,
-                'pending': total_pending
+                'students': class_totals['students'],
+                'collected': class_totals['collected'],
+                'pending': class_totals['pending']
             })
-    
-    conn.close()
-    
-    return render_template('reports.html', class_summary=class_summary)
+
+    payload = {'class_summary': class_summary}
+    with _view_cache_lock:
+        _reports_cache['token'] = token
+        _reports_cache['payload'] = payload
+        _reports_cache['expires'] = time.monotonic() + VIEW_CACHE_TTL
+    return render_template('reports.html', **payload)
 
 @app.route('/reminders')
 @login_required
 def reminders():
     conn = get_db()
-    
+
+    # Only one page of defaulters is fetched and rendered; the database
+    # filters the rest and keeps the headline totals accurate
+    page = max(request.args.get('page', 1, type=int), 1)
+    size = min(max(request.args.get('size', 50, type=int), 1), 200)
+
+    token = _data_version(conn) + (page, size)
+    # As in reports(): read under the lock, render after releasing it
+    with _view_cache_lock:
+        if _reminders_cache['token'] == token and time.monotonic() < _reminders_cache['expires']:
+            payload = _reminders_cache['payload']
+        else:
+            payload = None
+    if payload is not None:
+        return render_template('reminders.html', **payload)
+
+    # SUM, MAX and months_enrolled all come out of the same aggregation
+    # pass; the HAVING clause keeps only students with pending months
+    c = dict_cursor(conn)
     if USE_POSTGRES and DATABASE_URL:
-        c = conn.cursor(cursor_factory=RealDictCursor)
-        c.execute('SELECT * FROM students ORDER BY name')
+        c.execute('''SELECT s.name, s.class, s.monthly_fee::float8 AS monthly_fee,
+                            COALESCE(SUM(p.amount), 0)::float8 AS paid,
+                            MAX(p.payment_date) AS last_payment,
+                            ((DATE_PART('year', CURRENT_DATE) - DATE_PART('year', s.date_added)) * 12
+                             + DATE_PART('month', CURRENT_DATE) - DATE_PART('month', s.date_added)
+                             + 1)::int AS months_enrolled
+                     FROM students s
+                     LEFT JOIN student_payments p ON p.student_id = s.id
+                     GROUP BY s.id
+                     HAVING ((DATE_PART('year', CURRENT_DATE) - DATE_PART('year', s.date_added)) * 12
+                             + DATE_PART('month', CURRENT_DATE) - DATE_PART('month', s.date_added) + 1)::int
+                            - CASE WHEN s.monthly_fee > 0
+                                   THEN FLOOR(COALESCE(SUM(p.amount), 0) / s.monthly_fee)::int
+                                   ELSE 0 END > 0
+                     ORDER BY s.name LIMIT %s OFFSET %s''', (size, (page - 1) * size))
         students = c.fetchall()
+
+        # Headline numbers cover every defaulter, not just this page
+        c.execute('''SELECT COUNT(*) AS n, COALESCE(SUM(pending_amount), 0)::float8 AS total FROM (
+                         SELECT s.monthly_fee * ((DATE_PART('year', CURRENT_DATE) - DATE_PART('year', s.date_added)) * 12
+                                 + DATE_PART('month', CURRENT_DATE) - DATE_PART('month', s.date_added) + 1)
+                                - COALESCE(SUM(p.amount), 0) AS pending_amount
+                         FROM students s
+                         LEFT JOIN student_payments p ON p.student_id = s.id
+                         GROUP BY s.id
+                         HAVING ((DATE_PART('year', CURRENT_DATE) - DATE_PART('year', s.date_added)) * 12
+                                 + DATE_PART('month', CURRENT_DATE) - DATE_PART('month', s.date_added) + 1)::int
+                                - CASE WHEN s.monthly_fee > 0
+                                       THEN FLOOR(COALESCE(SUM(p.amount), 0) / s.monthly_fee)::int
+                                       ELSE 0 END > 0) t''')
+        summary = c.fetchone()
+        total_defaulters, total_pending = summary['n'], summary['total']
     else:
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        c.execute('SELECT * FROM students ORDER BY name')
+        c.execute('''SELECT s.name, s.class, s.monthly_fee,
+                            COALESCE(SUM(p.amount), 0) AS paid,
+                            MAX(p.payment_date) AS last_payment,
+                            ((strftime('%Y', 'now', 'localtime') - strftime('%Y', s.date_added)) * 12
+                             + (strftime('%m', 'now', 'localtime') - strftime('%m', s.date_added))
+                             + 1) AS months_enrolled
+                     FROM students s
+                     LEFT JOIN student_payments p ON p.student_id = s.id
+                     GROUP BY s.id
+                     HAVING months_enrolled
+                            - CASE WHEN s.monthly_fee > 0
+                                   THEN CAST(COALESCE(SUM(p.amount), 0) / s.monthly_fee AS INTEGER)
+                                   ELSE 0 END > 0
+                     ORDER BY s.name LIMIT ? OFFSET ?''', (size, (page - 1) * size))
         students = c.fetchall()
-    
-    defaulters = []
-    total_pending = 0
-    
-    for student in students:
-        if USE_POSTGRES and DATABASE_URL:
-            c.execute('SELECT COALESCE(SUM(amount), 0) FROM student_payments WHERE student_id = %s', (student['id'],))
-            total_paid = float(c.fetchone()[0])
-            c.execute('SELECT MAX(payment_date) FROM student_payments WHERE student_id = %s', (student['id'],))
-            last_payment = c.fetchone()[0]
-            date_added = student['date_added']
+
+        # Headline numbers cover every defaulter, not just this page
+        c.execute('''SELECT COUNT(*) AS n, COALESCE(SUM(pending_amount), 0) AS total FROM (
+                         SELECT s.monthly_fee * (((strftime('%Y', 'now', 'localtime') - strftime('%Y', s.date_added)) * 12
+                                 + (strftime('%m', 'now', 'localtime') - strftime('%m', s.date_added))) + 1)
+                                - COALESCE(SUM(p.amount), 0) AS pending_amount,
+                                (((strftime('%Y', 'now', 'localtime') - strftime('%Y', s.date_added)) * 12
+                                 + (strftime('%m', 'now', 'localtime') - strftime('%m', s.date_added))) + 1) AS months_enrolled
+                         FROM students s
+                         LEFT JOIN student_payments p ON p.student_id = s.id
+                         GROUP BY s.id
+                         HAVING months_enrolled
+                                - CASE WHEN s.monthly_fee > 0
+                                       THEN CAST(COALESCE(SUM(p.amount), 0) / s.monthly_fee AS INTEGER)
+                                       ELSE 0 END > 0) t''')
+        summary = c.fetchone()
+        total_defaulters, total_pending = summary['n'], summary['total']
+    n = len(students)
+
+    # Vectorize the per-student arithmetic: one pass over contiguous
+    # arrays instead of scalar float maths per row
+    paid = np.fromiter((s['paid'] for s in students), dtype=np.float64, count=n)
+    monthly_fee = np.fromiter((s['monthly_fee'] for s in students), dtype=np.float64, count=n)
+    months_enrolled = np.fromiter((s['months_enrolled'] for s in students), dtype=np.int64, count=n)
+
+    pending = monthly_fee * months_enrolled - paid
+    has_fee = monthly_fee > 0
+    paid_months = np.where(has_fee, paid // np.where(has_fee, monthly_fee, 1.0), 0).astype(np.int64)
+    pending_months = months_enrolled - paid_months
+
+    # Building the table rows here skips Jinja's per-row loop overhead;
+    # escape() covers the user-entered fields
+    rows = []
+    for i, student in enumerate(students):
+        pm = int(pending_months[i])
+        if pm >= 3:
+            badge = '<span class="status-badge status-critical">Critical</span>'
+        elif pm >= 2:
+            badge = '<span class="status-badge status-warning">Warning</span>'
         else:
-            c.execute('SELECT SUM(amount) FROM student_payments WHERE student_id = ?', (student['id'],))
-            total_paid = c.fetchone()[0] or 0
-            c.execute('SELECT MAX(payment_date) FROM student_payments WHERE student_id = ?', (student['id'],))
-            last_payment = c.fetchone()[0]
-            date_added = datetime.strptime(student['date_added'], '%Y-%m-%d')
-        
-        months_enrolled = ((datetime.now().year - date_added.year) * 12 + 
-                          datetime.now().month - date_added.month) + 1
-        
-        monthly_fee = float(student['monthly_fee'])
-        total_due = monthly_fee * months_enrolled
-        pending_amount = total_due - total_paid
-        paid_months = int(total_paid / monthly_fee) if monthly_fee > 0 else 0
-        pending_months = months_enrolled - paid_months
-        
-        if pending_months > 0:
-            defaulters.append({
-                'name': student['name'],
-                'class': student['class'],
-                'monthly_fee': monthly_fee,
-                'pending_months': pending_months,
-                'pending_amount': pending_amount,
-                'last_payment': str(last_payment) if last_payment else None
-            })
-            total_pending += pending_amount
-    
-    conn.close()
-    
-    return render_template('reminders.html', defaulters=defaulters, total_pending=total_pending)
+            badge = '<span class="status-badge status-due">Due</span>'
+        last_payment = student['last_payment']
+        rows.append(
+            f'<tr>'
+            f'<td>{escape(student["name"])}</td>'
+            f'<td>{escape(student["class"])}</td>'
+            f'<td>Rs. {monthly_fee[i]:.2f}</td>'
+            f'<td class="pending-pulse">{pm}</td>'
+            f'<td class="pending-pulse">Rs. {pending[i]:.2f}</td>'
+            f'<td>{escape(str(last_payment)) if last_payment else "No payments"}</td>'
+            f'<td>{badge}</td>'
+            f'</tr>'
+        )
+
+    payload = {'rows_html': Markup(''.join(rows)), 'total_pending': total_pending,
+               'total_defaulters': total_defaulters, 'page': page, 'size': size,
+               'has_next': page * size < total_defaulters}
+    with _view_cache_lock:
+        _reminders_cache['token'] = token
+        _reminders_cache['payload'] = payload
+        _reminders_cache['expires'] = time.monotonic() + VIEW_CACHE_TTL
+    return render_template('reminders.html', **payload)
+
+# Run schema setup once at process start; with gunicorn --preload this
+# happens in the master before workers fork, so they never race on it
+init_db()
 
 if __name__ == '__main__':
-    init_db()
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # Debug mode re-scans templates and instruments every request; for
+    # anything beyond local poking run via gunicorn (see render.yaml)
+    app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
@@ -2,7 +2,4 @@
 # exit on error
 set -o errexit
 
-cd academy_management2
-pip install -r ../requirements.txt
-python manage.py collectstatic --no-input
-python manage.py migrate
+pip install -r requirements.txt